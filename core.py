@@ -2,30 +2,39 @@
 """Core API helpers for BeepConf Qt Chat.
 
 Provides:
-- ApiWorker: QThread that runs OpenAI chat.completions.create with a fallback
-  for client versions that don't accept request_timeout.
+- ApiWorker: QThread that runs OpenAI chat.completions.create (optionally
+  streamed) with a per-request timeout.
+- ExactCache: on-disk cache of deterministic completions keyed by the request.
 - notify, copy_to_clipboard, token estimator, simple history persistence helpers.
 """
+import hashlib
 import json
 import os
+import shelve
+import stat
+import tempfile
+import threading
 import traceback
 from pathlib import Path
 from typing import List, Optional
 
-import pyperclip
-from openai import OpenAI
 from PyQt5 import QtCore
 
+# openai, httpx, tiktoken and pyperclip are imported where they are first
+# used: together they add hundreds of ms to startup
+
 try:
-    import tiktoken
+    import orjson
 except Exception:
-    tiktoken = None
+    orjson = None
 
 
 APP_NAME = "BeepConf Qt Chat"
 CONFIG_DIR = Path.home() / ".beepconf_qt_chat"
 CONFIG_FILE = CONFIG_DIR / "config.json"
-HISTORY_FILE = CONFIG_DIR / "history.json"
+HISTORY_FILE = CONFIG_DIR / "history.jsonl"
+LEGACY_HISTORY_FILE = CONFIG_DIR / "history.json"
+EXACT_CACHE_FILE = CONFIG_DIR / "exact_cache.db"
 
 
 def ensure_config_dir():
@@ -35,17 +44,97 @@ def ensure_config_dir():
 def load_json(path: Path, default):
     try:
         if path.exists():
-            with path.open("r", encoding="utf-8") as f:
-                return json.load(f)
+            raw = path.read_bytes()
+            return orjson.loads(raw) if orjson else json.loads(raw)
     except Exception:
         return default
     return default
 
 
+def _atomic_write(path: Path, raw: bytes):
+    # write next to the target and swap it in, so a crash never leaves a half-written file
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        try:
+            # mkstemp creates 0600 files: keep the target's mode, or the umask default for a new file
+            try:
+                mode = stat.S_IMODE(os.stat(path).st_mode)
+            except FileNotFoundError:
+                umask = os.umask(0)
+                os.umask(umask)
+                mode = 0o666 & ~umask
+            os.chmod(tmp, mode)
+            view = memoryview(raw)
+            while view:
+                view = view[os.write(fd, view):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
 def save_json(path: Path, data):
     ensure_config_dir()
-    with path.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    if orjson:
+        raw = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    else:
+        raw = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    _atomic_write(path, raw)
+
+
+def _dumps_line(entry) -> bytes:
+    if orjson:
+        return orjson.dumps(entry) + b"\n"
+    return (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def append_history(entry: dict):
+    """Append one entry to the JSONL history file without rewriting it."""
+    ensure_config_dir()
+    with HISTORY_FILE.open("ab+") as f:
+        line = _dumps_line(entry)
+        # a crash mid-append leaves a torn last line; start a fresh one so this entry survives
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                line = b"\n" + line
+        f.write(line)
+
+
+def load_history() -> List[dict]:
+    """Read the JSONL history, converting a legacy history.json on first use."""
+    if not HISTORY_FILE.exists() and LEGACY_HISTORY_FILE.exists():
+        # parse directly (no load_json default): an unreadable legacy file is left untouched
+        try:
+            raw = LEGACY_HISTORY_FILE.read_bytes()
+            legacy = orjson.loads(raw) if orjson else json.loads(raw)
+        except Exception:
+            legacy = None
+        if isinstance(legacy, list):
+            ensure_config_dir()
+            _atomic_write(HISTORY_FILE, b"".join(_dumps_line(e) for e in legacy))
+            os.replace(LEGACY_HISTORY_FILE, LEGACY_HISTORY_FILE.with_suffix(LEGACY_HISTORY_FILE.suffix + ".bak"))
+    hist = []
+    try:
+        with HISTORY_FILE.open("rb") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    hist.append(orjson.loads(line) if orjson else json.loads(line))
+                except Exception:
+                    # skip a torn last line left by a crash mid-append
+                    pass
+    except Exception:
+        pass
+    return hist
 
 
 def notify(title: str, msg: str, duration: int = 5):
@@ -80,34 +169,126 @@ def notify(title: str, msg: str, duration: int = 5):
 
 def copy_to_clipboard(text: str):
     try:
+        import pyperclip
+
         pyperclip.copy(text)
         return True
     except Exception:
         return False
 
 
+_ENCODERS = {}
+
+
+def _get_encoder(model: str):
+    """Return a tiktoken encoding for model (None without tiktoken), built once per model name."""
+    if model not in _ENCODERS:
+        try:
+            import tiktoken
+        except Exception:
+            _ENCODERS[model] = None
+            return None
+        try:
+            enc = tiktoken.encoding_for_model(model)
+        except Exception:
+            enc = tiktoken.get_encoding("cl100k_base")
+        _ENCODERS[model] = enc
+    return _ENCODERS[model]
+
+
 def estimate_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
     if not text:
         return 0
-    if tiktoken:
-        try:
-            enc = None
-            try:
-                enc = tiktoken.encoding_for_model(model)
-            except Exception:
-                enc = tiktoken.get_encoding("cl100k_base")
+    try:
+        enc = _get_encoder(model)
+        if enc:
             return len(enc.encode(text))
-        except Exception:
-            pass
+    except Exception:
+        pass
     # fallback heuristic
     words = len(text.split())
     return int(max(1, words / 0.75))
 
 
+# shelve/dbm files are not safe for concurrent writers: every ExactCache on
+# the same file shares one lock
+_CACHE_LOCKS = {}
+_CACHE_LOCKS_GUARD = threading.Lock()
+
+
+class ExactCache:
+    """Disk cache of chat completions keyed by the exact request.
+
+    Only deterministic requests (temperature 0, single candidate) are cached
+    unless allow_sampling is set.
+    """
+
+    def __init__(self, path: Path = EXACT_CACHE_FILE, allow_sampling: bool = False):
+        self.path = path
+        self.allow_sampling = allow_sampling
+        with _CACHE_LOCKS_GUARD:
+            self._lock = _CACHE_LOCKS.setdefault(os.path.abspath(path), threading.Lock())
+
+    def key(self, model: str, messages: List[dict], temperature: float, max_tokens: int, n: int = 1, base_url: Optional[str] = None) -> Optional[str]:
+        if n > 1 or (temperature > 0 and not self.allow_sampling):
+            return None
+        # base_url is part of the key: different endpoints may serve the same model name
+        payload = json.dumps([base_url, model, messages, temperature, max_tokens], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        try:
+            with self._lock, shelve.open(str(self.path), flag="r") as db:
+                return db.get(key)
+        except Exception:
+            return None
+
+    def set(self, key: str, value):
+        try:
+            ensure_config_dir()
+            with self._lock, shelve.open(str(self.path)) as db:
+                db[key] = value
+        except Exception:
+            pass
+
+
+_CLIENTS = {}
+
+
+def _get_client(api_key: Optional[str], base_url: Optional[str]):
+    """Return a shared OpenAI client so its HTTP connection pool is reused across requests."""
+    key = (api_key, base_url)
+    client = _CLIENTS.get(key)
+    if client is None:
+        import httpx
+        from openai import DefaultHttpxClient, OpenAI
+
+        client_kwargs = {
+            # keep idle connections around so follow-up requests skip the TLS handshake;
+            # HTTP/2 lets concurrent workers share one connection
+            "http_client": DefaultHttpxClient(http2=True, limits=httpx.Limits(max_connections=20, keepalive_expiry=60)),
+        }
+        if api_key:
+            client_kwargs["api_key"] = api_key
+        if base_url:
+            client_kwargs["base_url"] = base_url
+        client = OpenAI(**client_kwargs)
+        _CLIENTS[key] = client
+    return client
+
+
 class ApiWorker(QtCore.QThread):
+    """Run one chat completion off the GUI thread.
+
+    With stream=True, ``chunk`` carries text deltas of the first choice as they
+    arrive and ``finished`` receives the list of full choice texts instead of
+    the response object.
+    """
+
     finished = QtCore.pyqtSignal(object, object)  # (response, error)
+    chunk = QtCore.pyqtSignal(str)  # streamed text delta
 
-    def __init__(self, api_key: Optional[str], base_url: Optional[str], messages: List[dict], model: str, temperature: float = 0.2, n: int = 1, timeout: int = 60):
+    def __init__(self, api_key: Optional[str], base_url: Optional[str], messages: List[dict], model: str, temperature: float = 0.2, n: int = 1, timeout: int = 60, stream: bool = False, cache: Optional[ExactCache] = None, max_tokens: int = 1024):
         super().__init__()
         self.api_key = api_key
         self.base_url = base_url
@@ -116,40 +297,50 @@ class ApiWorker(QtCore.QThread):
         self.temperature = temperature
         self.n = n
         self.timeout = timeout
+        self.stream = stream
+        self.cache = cache
+        self.max_tokens = max_tokens
 
     def run(self):
         try:
-            client_kwargs = {}
-            if self.api_key:
-                client_kwargs["api_key"] = self.api_key
-            if self.base_url:
-                client_kwargs["api_base"] = self.base_url
-            client = OpenAI(**client_kwargs) if client_kwargs else OpenAI()
+            cache_key = None
+            if self.cache and not self.stream:
+                cache_key = self.cache.key(self.model, self.messages, self.temperature, self.max_tokens, self.n, self.base_url)
+                cached = self.cache.get(cache_key) if cache_key else None
+                if cached is not None:
+                    self.finished.emit(cached, None)
+                    return
 
-            try:
-                resp = client.chat.completions.create(
-                    model=self.model,
-                    messages=self.messages,
-                    temperature=self.temperature,
-                    n=self.n,
-                    max_tokens=1024,
-                    request_timeout=self.timeout,
-                )
-            except TypeError as e:
-                # older/newer clients may not accept request_timeout kwarg
-                if "request_timeout" in str(e):
-                    resp = client.chat.completions.create(
-                        model=self.model,
-                        messages=self.messages,
-                        temperature=self.temperature,
-                        n=self.n,
-                        max_tokens=1024,
-                    )
-                else:
-                    raise
+            client = _get_client(self.api_key, self.base_url)
+            kwargs = dict(
+                model=self.model,
+                messages=self.messages,
+                temperature=self.temperature,
+                n=self.n,
+                max_tokens=self.max_tokens,
+                stream=self.stream,
+            )
+
+            resp = client.chat.completions.create(timeout=self.timeout, **kwargs)
+
+            if self.stream:
+                resp = self._consume_stream(resp)
+            elif cache_key:
+                self.cache.set(cache_key, resp)
 
             self.finished.emit(resp, None)
         except Exception as e:
             tb = traceback.format_exc()
             self.finished.emit(None, (e, tb))
 
+    def _consume_stream(self, stream) -> List[str]:
+        parts = {}
+        for ev in stream:
+            for c in ev.choices:
+                delta = c.delta.content if c.delta else None
+                if not delta:
+                    continue
+                parts.setdefault(c.index, []).append(delta)
+                if c.index == 0:
+                    self.chunk.emit(delta)
+        return ["".join(parts[i]) for i in sorted(parts)]
@@ -9,14 +9,21 @@ from datetime import datetime
 from pathlib import Path
 import sys
 import os
+import time
 import traceback
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 try:
     # For specific quota/rate-limit handling
     from openai import RateLimitError  # type: ignore
 except Exception:
     RateLimitError = Exception  # fallback
 
+try:
+    import orjson
+except Exception:
+    orjson = None
+
 try:
     import flet as ft
 except Exception:
@@ -26,90 +33,111 @@ except Exception:
 # -------------------------------
 # Backend integration hook
 # -------------------------------
-async def send_to_backend(prompt: str, attached_preset: str | None) -> str:
+def extract_text(resp) -> str:
+    """Stripped text of the first choice of a chat completion (requests use n=1)."""
+    try:
+        return (resp.choices[0].message.content or "").strip()
+    except (AttributeError, IndexError):
+        return ""
+
+
+# Read once at import; the app does not support changing these while running
+_MODEL = os.environ.get("OPENAI_MODEL") or "gpt-3.5-turbo"
+try:
+    _TIMEOUT = int(os.environ.get("OPENAI_TIMEOUT") or 60)
+except ValueError:
+    # a malformed value must not keep the app from starting
+    _TIMEOUT = 60
+
+_client: AsyncOpenAI | None = None
+
+
+def _get_client() -> AsyncOpenAI:
+    """Build the AsyncOpenAI client once; its connection pool is shared by all sends."""
+    global _client
+    if _client is None:
+        api_key = os.environ.get("OPENAI_API_KEY")
+        base = os.environ.get("OPENAI_API_BASE") or os.environ.get("OPENAI_BASE_URL")
+
+        client_kwargs = {
+            "timeout": _TIMEOUT,
+            # HTTP/2: concurrent sends multiplex over one TLS connection
+            "http_client": DefaultAsyncHttpxClient(http2=True, limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)),
+        }
+        if api_key:
+            client_kwargs["api_key"] = api_key
+        if base:
+            client_kwargs["base_url"] = base
+        _client = AsyncOpenAI(**client_kwargs)
+    return _client
+
+
+def _build_messages(prompt: str, attached_preset: str | None) -> list[dict]:
+    # Static instruction first, then the preset, then the prompt: an
+    # unchanged prefix lets the server reuse its prompt cache
+    messages = [{"role": "system", "content": "You are a helpful assistant."}]
+    if attached_preset:
+        messages.append({"role": "system", "content": attached_preset})
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+async def send_to_backend(prompt: str, attached_preset: str | None, on_delta=None) -> str:
     """
-    Call OpenAI Chat Completions via the official SDK in a threadpool to
-    avoid blocking the Flet asyncio loop.
+    Call OpenAI Chat Completions via the official async SDK client, directly
+    on the Flet asyncio loop. When on_delta is given the response is streamed
+    and on_delta(text) is called for every chunk as it arrives.
 
     Uses environment variables:
       - OPENAI_API_KEY
       - OPENAI_API_BASE or OPENAI_BASE_URL
       - OPENAI_MODEL (optional, default gpt-3.5-turbo)
       - OPENAI_TIMEOUT (optional seconds, default 60)
-    Returns the combined text response (first candidate by default) or an
+    Returns the text of the first (only) candidate or an
     error string starting with "ERROR:" on failure.
     """
-    loop = asyncio.get_running_loop()
+    try:
+        resp = await _get_client().chat.completions.create(
+            model=_MODEL,
+            messages=_build_messages(prompt, attached_preset),
+            temperature=0.2,
+            n=1,
+            max_tokens=1024,
+            stream=on_delta is not None,
+        )
+        if on_delta is None:
+            return extract_text(resp)
+
+        parts = []
+        async for chunk in resp:
+            for c in chunk.choices:
+                delta = c.delta.content if c.delta else None
+                if c.index == 0 and delta:
+                    parts.append(delta)
+                    on_delta(delta)
+        return "".join(parts).strip()
+    except RateLimitError as re:
+        # Normalize rate-limit / insufficient quota to a simple code the UI can detect
+        return f"ERROR:429_INSUFFICIENT_QUOTA|{re}"
+    except Exception as e:
+        tb = traceback.format_exc()
+        # return an informative error to the caller
+        return f"ERROR:GENERIC|{e}\n{tb}"
+
+
+async def send_many(prompts: list[str], attached_preset: str | None, limit: int = 8) -> list[str]:
+    """Send several prompts concurrently, at most `limit` in flight at a time.
+
+    Results come back in prompt order, with the same "ERROR:" convention as
+    send_to_backend.
+    """
+    sem = asyncio.Semaphore(limit)
 
-    def blocking_call():
-        try:
-            api_key = os.environ.get("OPENAI_API_KEY")
-            base = os.environ.get("OPENAI_API_BASE") or os.environ.get("OPENAI_BASE_URL")
-            model = os.environ.get("OPENAI_MODEL") or "gpt-3.5-turbo"
-            timeout = int(os.environ.get("OPENAI_TIMEOUT") or 60)
-
-            client_kwargs = {}
-            if api_key:
-                client_kwargs["api_key"] = api_key
-            if base:
-                client_kwargs["api_base"] = base
-
-            client = OpenAI(**client_kwargs) if client_kwargs else OpenAI()
-
-            messages = []
-            if attached_preset:
-                messages.append({"role": "system", "content": attached_preset})
-            # keep a short system instruction
-            messages.append({"role": "system", "content": "You are a helpful assistant."})
-            messages.append({"role": "user", "content": prompt})
-
-            try:
-                resp = client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=0.2,
-                    n=1,
-                    max_tokens=1024,
-                    request_timeout=timeout,
-                )
-            except TypeError as te:
-                if "request_timeout" in str(te):
-                    resp = client.chat.completions.create(
-                        model=model,
-                        messages=messages,
-                        temperature=0.2,
-                        n=1,
-                        max_tokens=1024,
-                    )
-                else:
-                    raise
-
-            # Parse response
-            choices = getattr(resp, "choices", None) or (resp.get("choices") if isinstance(resp, dict) else [])
-            parts = []
-            for c in choices:
-                if isinstance(c, dict):
-                    m = c.get("message") or {}
-                    txt = m.get("content") or c.get("text") or ""
-                else:
-                    msg = getattr(c, "message", None)
-                    txt = getattr(msg, "content", "") if msg else getattr(c, "text", "") or ""
-                txt = (txt or "").strip()
-                if txt:
-                    parts.append(txt)
-
-            return "\n\n".join(parts) if parts else ""
-        except RateLimitError as re:
-            # Normalize rate-limit / insufficient quota to a simple code the UI can detect
-            return f"ERROR:429_INSUFFICIENT_QUOTA|{re}"
-        except Exception as e:
-            tb = traceback.format_exc()
-            # return an informative error to the caller
-            return f"ERROR:GENERIC|{e}\n{tb}"
-
-    # run blocking call in default executor
-    result = await loop.run_in_executor(None, blocking_call)
-    return result
+    async def one(prompt: str) -> str:
+        async with sem:
+            return await send_to_backend(prompt, attached_preset)
+
+    return await asyncio.gather(*(one(p) for p in prompts))
 
 
 # -------------------------------
@@ -117,19 +145,30 @@ async def send_to_backend(prompt: str, attached_preset: str | None) -> str:
 # -------------------------------
 HIST_KEY = "beep_hist"
 THEME_KEY = "beep_theme"
+HISTORY_PAGE_SIZE = 50  # sidebar entries built per batch; older ones load on scroll
 PRESETS_FILE = str(Path(__file__).parent / "presets.json")
 
 
+_presets_cache: tuple[float, list[dict]] | None = None  # (mtime, presets)
+
+
 def load_presets() -> list[dict]:
     """
     Формат: [{"name":"...", "text":"..."}, ...]
     Если файла нет — вернём пару демо-пресетов.
+    Результат кэшируется, пока не изменится mtime файла.
     """
+    global _presets_cache
     try:
+        mtime = os.path.getmtime(PRESETS_FILE)
+        if _presets_cache and _presets_cache[0] == mtime:
+            return _presets_cache[1]
         with open(PRESETS_FILE, "r", encoding="utf-8") as f:
             data = json.load(f)
             if isinstance(data, list):
-                return [p for p in data if isinstance(p, dict) and "text" in p]
+                presets = [p for p in data if isinstance(p, dict) and "text" in p]
+                _presets_cache = (mtime, presets)
+                return presets
     except Exception:
         pass
     return [
@@ -138,10 +177,20 @@ def load_presets() -> list[dict]:
     ]
 
 
+def _format_when(t_ms: int) -> str:
+    return datetime.fromtimestamp(t_ms / 1000).strftime("%Y-%m-%d %H:%M")
+
+
+def _first_line(s: str, n: int = 60) -> str:
+    """First line of s, cut to n chars, without splitting the whole string."""
+    i = s.find("\n")
+    return (s if i < 0 else s[:i])[:n]
+
+
 def load_history(page: ft.Page) -> list[dict]:
     try:
         raw = page.client_storage.get(HIST_KEY)
-        hist = json.loads(raw) if raw else []
+        hist = (orjson.loads(raw) if orjson else json.loads(raw)) if raw else []
         if isinstance(hist, list):
             return hist[-200:]
     except Exception:
@@ -149,9 +198,23 @@ def load_history(page: ft.Page) -> list[dict]:
     return []
 
 
+def _dump_history(hist: list[dict]) -> str:
+    if orjson:
+        return orjson.dumps(hist[-200:]).decode("utf-8")
+    return json.dumps(hist[-200:], ensure_ascii=False)
+
+
 def save_history(page: ft.Page, hist: list[dict]) -> None:
+    # Blocks until the client replies: call from handler threads, never from the event loop
+    try:
+        page.client_storage.set(HIST_KEY, _dump_history(hist))
+    except Exception:
+        pass
+
+
+async def save_history_async(page: ft.Page, hist: list[dict]) -> None:
     try:
-        page.client_storage.set(HIST_KEY, json.dumps(hist[-200:], ensure_ascii=False))
+        await page.client_storage.set_async(HIST_KEY, _dump_history(hist))
     except Exception:
         pass
 
@@ -204,6 +267,38 @@ class Palette:
             self.scroll = "#9aa7be77"
 
 
+# Palettes are never mutated, so build each once
+LIGHT_PAL = Palette(dark=False)
+DARK_PAL = Palette(dark=True)
+
+
+_BUBBLE_SHADOW = ft.BoxShadow(blur_radius=4, color=ft.Colors.with_opacity(0.05, "#000000"))
+_BUBBLE_PADDING = ft.padding.symmetric(10, 12)
+_BUBBLE_RADIUS_USER = ft.border_radius.only(top_left=14, top_right=6, bottom_left=14, bottom_right=14)
+_BUBBLE_RADIUS_AI = ft.border_radius.all(14)
+_ROW_STYLES: dict = {}
+
+
+def _row_styles(pal: Palette):
+    """Style objects shared by every message row of a palette: (user border, AI border, copy button style)."""
+    styles = _ROW_STYLES.get(pal)
+    if styles is None:
+        styles = _ROW_STYLES[pal] = (
+            ft.border.all(1, ft.Colors.with_opacity(0, pal.border)),
+            ft.border.all(1, pal.border),
+            ft.ButtonStyle(
+                padding=ft.padding.symmetric(4, 8),
+                shape=ft.RoundedRectangleBorder(radius=8),
+                side=ft.BorderSide(1, pal.border),
+                bgcolor={
+                    ft.ControlState.DEFAULT: ft.Colors.TRANSPARENT,
+                    ft.ControlState.HOVERED: ft.Colors.with_opacity(0.08, "#64748B"),
+                },
+            ),
+        )
+    return styles
+
+
 def message_row(
     text: str,
     role: str,  # "req" | "resp"
@@ -211,6 +306,7 @@ def message_row(
     on_copy=None,
 ) -> ft.Row:
     is_user = role == "req"
+    user_border, ai_border, copy_style = _row_styles(pal)
 
     # CircleAvatar doesn't support gradient background; use solid bgcolor and color for text
     avatar = ft.CircleAvatar(
@@ -224,17 +320,12 @@ def message_row(
 
     bubble = ft.Container(
         content=ft.Text(text, selectable=True),
-        padding=ft.padding.symmetric(10, 12),
+        padding=_BUBBLE_PADDING,
         width=None,
         bgcolor=bubble_bg,
-    border=ft.border.all(1, pal.border if not is_user else ft.Colors.with_opacity(0, pal.border)),
-        border_radius=ft.border_radius.only(
-            top_left=14 if not is_user else 14,
-            top_right=6 if is_user else 14,
-            bottom_left=14,
-            bottom_right=14,
-        ),
-    shadow=ft.BoxShadow(blur_radius=4, color=ft.Colors.with_opacity(0.05, "#000000")),
+        border=user_border if is_user else ai_border,
+        border_radius=_BUBBLE_RADIUS_USER if is_user else _BUBBLE_RADIUS_AI,
+        shadow=_BUBBLE_SHADOW,
     )
 
     row_children = []
@@ -244,15 +335,7 @@ def message_row(
     else:
         copy_btn = ft.TextButton(
             content=ft.Row([ft.Icon(ft.Icons.CONTENT_COPY, size=14), ft.Text("Copy", size=12)], spacing=4),
-            style=ft.ButtonStyle(
-                padding=ft.padding.symmetric(4, 8),
-                shape=ft.RoundedRectangleBorder(radius=8),
-                side=ft.BorderSide(1, pal.border),
-                bgcolor={
-                    ft.ControlState.DEFAULT: ft.Colors.TRANSPARENT,
-                    ft.ControlState.HOVERED: ft.Colors.with_opacity(0.08, "#64748B"),
-                },
-            ),
+            style=copy_style,
             on_click=lambda _: on_copy(text) if on_copy else None,
         )
         row_children = [avatar, bubble, copy_btn, ft.Container(expand=1)]
@@ -271,7 +354,7 @@ def flet_main(page: ft.Page):
     # Theme mode expects ft.ThemeMode enum, but we persist a string ("light"|"dark")
     theme_mode_str = load_theme(page)
     page.theme_mode = ft.ThemeMode.DARK if theme_mode_str == "dark" else ft.ThemeMode.LIGHT
-    pal = Palette(dark=page.theme_mode == ft.ThemeMode.DARK)
+    pal = DARK_PAL if page.theme_mode == ft.ThemeMode.DARK else LIGHT_PAL
     page.bgcolor = pal.bg
 
     brand_dot = ft.Container(
@@ -303,18 +386,39 @@ def flet_main(page: ft.Page):
     load_btn = ft.ElevatedButton("Attach", icon="link", on_click=attach_preset)
     detach_btn = ft.TextButton("Detach", icon="link_off", on_click=detach_preset)
 
-    history_col = ft.Column(spacing=8, scroll=ft.ScrollMode.ADAPTIVE)
+    # ListView only builds the rows that are scrolled into view, unlike a scrolling Column
+    history_col = ft.ListView(spacing=8, expand=True, on_scroll_interval=100)
+
+    def make_history_item(h: dict) -> ft.OutlinedButton:
+        # Label parts are computed once per entry and stored with it
+        if "when" not in h:
+            h["when"] = _format_when(h.get("t", 0))
+        if "preview" not in h:
+            h["preview"] = _first_line(h.get("req") or "")
+        return ft.OutlinedButton(f"{h['when']} — {h['preview']}", style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=10)), on_click=lambda e, item=h: show_item(item))
 
     def render_history_list():
+        # Full rebuild: only used for the initial load and after clearing
         history_col.controls.clear()
-        hist = load_history(page)
-        for h in reversed(hist):
-            when = datetime.fromtimestamp(h.get("t", 0) / 1000).strftime("%Y-%m-%d %H:%M")
-            preview = (h.get("req") or "")[:60].replace("\n", " ")
-            btn = ft.OutlinedButton(f"{when} — {preview}", style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=10)), on_click=lambda e, item=h: show_item(item))
-            history_col.controls.append(btn)
+        for h in reversed(state["hist"][-HISTORY_PAGE_SIZE:]):
+            history_col.controls.append(make_history_item(h))
         history_col.update()
 
+    # async: runs on the event loop, serialized with itself and with save_hist_pair
+    # (sync handlers run on worker threads and could append the same batch twice)
+    async def load_older_history(e: ft.OnScrollEvent):
+        if e.pixels < e.max_scroll_extent - 100:
+            return
+        hist = state["hist"]
+        remaining = len(hist) - len(history_col.controls)
+        if remaining <= 0:
+            return
+        for h in reversed(hist[max(0, remaining - HISTORY_PAGE_SIZE):remaining]):
+            history_col.controls.append(make_history_item(h))
+        history_col.update()
+
+    history_col.on_scroll = load_older_history
+
     # ListView does not accept visual kwargs like bgcolor/border/radius on some Flet versions.
     # Visuals are provided by the surrounding Container in the layout below.
     output_lv = ft.ListView(expand=True, spacing=8, auto_scroll=True, padding=ft.padding.only(14, 14, 14, 8))
@@ -324,56 +428,140 @@ def flet_main(page: ft.Page):
     input_tf = ft.TextField(hint_text="Type your message... (Ctrl+Enter to send)", multiline=True, min_lines=3, max_lines=6, expand=True, border_radius=10, border_color=pal.border, on_change=lambda e: toggle_send_button())
     send_btn = ft.ElevatedButton("Send", icon="send", disabled=True)
     copy_last_btn = ft.TextButton("Copy", icon=ft.Icons.CONTENT_COPY)
+    batch_btn = ft.TextButton("Batch", icon="playlist_play", tooltip="Send each line as a separate prompt")
 
     theme_btn = ft.IconButton(icon=("dark_mode" if page.theme_mode == ft.ThemeMode.LIGHT else "light_mode"), tooltip="Toggle theme")
     clear_btn = ft.TextButton("Clear history", icon="clear_all")
 
     def toggle_theme(_):
         # Toggle between LIGHT and DARK and persist as string
+        nonlocal pal
         new_mode = ft.ThemeMode.DARK if page.theme_mode == ft.ThemeMode.LIGHT else ft.ThemeMode.LIGHT
         page.theme_mode = new_mode
         save_theme(page, "dark" if new_mode == ft.ThemeMode.DARK else "light")
-        page.clean()
-        flet_main(page)
+        # Restyle the existing controls instead of rebuilding the page, so
+        # only changed properties are sent to the client
+        pal = DARK_PAL if new_mode == ft.ThemeMode.DARK else LIGHT_PAL
+        theme_btn.icon = "dark_mode" if new_mode == ft.ThemeMode.LIGHT else "light_mode"
+        page.bgcolor = pal.bg
+        brand_dot.gradient = ft.RadialGradient(center=ft.Alignment(0.3, 0.3), radius=1.0, colors=["#7aa2ff", pal.primary])
+        for t in (*section_labels, typing_text, pinned.content):
+            t.color = pal.muted
+        for d in dividers:
+            d.color = pal.border
+        pinned.bgcolor = pal.accent
+        for box in (pinned, sidebar, top_bar):
+            box.border = ft.border.all(1, pal.border)
+        sidebar.bgcolor = top_bar.bgcolor = output_box.bgcolor = pal.card
+        input_tf.border_color = pal.border
+        # Bubbles bake palette colors into several nested controls; rebuild just those rows
+        rows = []
+        for row in output_lv.controls:
+            rows.append(make_message(*row.data))
+            for live in state["streams"]:
+                if live["row"] is row:
+                    live["row"] = rows[-1]
+        output_lv.controls[:] = rows
+        page.update()
 
     theme_btn.on_click = toggle_theme
 
     def toggle_send_button():
-        send_btn.disabled = not bool(input_tf.value.strip())
-        send_btn.update()
+        # Runs per keystroke: only talk to the client when the state flips
+        disabled = not input_tf.value.strip()
+        if disabled != send_btn.disabled:
+            send_btn.disabled = disabled
+            send_btn.update()
 
     def kb_handler(e: ft.KeyboardEvent):
-        if e.key == "Enter" and e.ctrl and input_tf.focused:
+        if e.key != "Enter":
+            return
+        if e.ctrl and input_tf.focused:
             do_send()
 
     page.on_keyboard_event = kb_handler
 
-    state = {"last_req_text": "", "last_resp_text": ""}
+    # History is parsed from client_storage once and kept in memory afterwards
+    state = {"last_resp_text": "", "hist": load_history(page), "shown_item": None, "save_fut": None, "streams": []}
 
-    def append_message(text: str, role: str):
-        nonlocal pal
+    def make_message(text: str, role: str) -> ft.Row:
         row = message_row(text=text, role=role, pal=pal, on_copy=lambda t: page.set_clipboard(t))
-        output_lv.controls.append(row)
-        output_lv.update()
+        row.data = (text, role)
+        return row
+
+    # append_message/save_hist_pair only mutate controls; callers push all
+    # pending changes with a single page.update()
+    def append_message(text: str, role: str):
+        state["shown_item"] = None
+        output_lv.controls.append(make_message(text, role))
+
+    async def flush_history():
+        await asyncio.sleep(0.5)
+        await save_history_async(page, state["hist"])
+
+    def schedule_save():
+        # Coalesce bursts of sends into one client_storage write
+        fut = state["save_fut"]
+        if fut and not fut.done():
+            fut.cancel()
+        state["save_fut"] = page.run_task(flush_history)
 
     def save_hist_pair(req: str, resp: str):
-        hist = load_history(page)
+        hist = state["hist"]
         hist.append({"t": int(datetime.now().timestamp() * 1000), "req": req, "resp": resp})
-        save_history(page, hist)
-        render_history_list()
+        del hist[:-200]
+        schedule_save()
+        # Newest entry goes on top; drop buttons that fell out of the stored window
+        history_col.controls.insert(0, make_history_item(hist[-1]))
+        del history_col.controls[len(hist):]
 
     def show_item(item: dict):
-        output_lv.controls.clear()
-        append_message(item.get("req", ""), "req")
-        append_message(item.get("resp", ""), "resp")
+        # Clicking the entry that is already displayed should not rebuild the bubbles
+        if state["shown_item"] is item:
+            return
+        output_lv.controls[:] = [make_message(item.get("req", ""), "req"), make_message(item.get("resp", ""), "resp")]
         output_lv.update()
+        state["shown_item"] = item
+
+    def make_on_delta(live: dict):
+        # Each send streams into its own bubble; live = {"row": ft.Row | None, "flush": float}
+        def on_delta(delta: str):
+            row = live["row"]
+            if row is None:
+                row = live["row"] = make_message("", "resp")
+                output_lv.controls.append(row)
+            bubble_text = row.controls[1].content
+            bubble_text.value += delta
+            row.data = (bubble_text.value, "resp")
+            # Push at most ~20 updates per second; the final text lands in on_task_done
+            now = time.monotonic()
+            if now - live["flush"] >= 0.05:
+                live["flush"] = now
+                output_lv.update()
+
+        return on_delta
+
+    async def process_send(prompt: str, preset: str | None, live: dict):
+        return await send_to_backend(prompt, preset, on_delta=make_on_delta(live))
+
+    def show_error(title: str):
+        page.snack_bar = ft.SnackBar(
+            content=ft.Text(title, color=ft.Colors.WHITE),
+            bgcolor=ft.Colors.RED_600,
+            show_close_icon=True,
+        )
+        page.snack_bar.open = True
 
-    async def process_send(prompt: str, preset: str | None):
-        return await send_to_backend(prompt, preset)
-
-    def on_task_done(t: asyncio.Task):
-        typing_text.visible = False
+    def on_task_done(req: str, live: dict, t: asyncio.Task):
+        # identity, not ==: two holders that have not streamed yet compare equal
+        state["streams"] = [x for x in state["streams"] if x is not live]
+        typing_text.visible = bool(state["streams"])
         send_btn.disabled = False
+        # The streamed bubble is replaced in place by a final one (its Copy button needs the full text)
+        slot = None
+        if live["row"] in output_lv.controls:
+            slot = output_lv.controls.index(live["row"])
+            del output_lv.controls[slot]
         try:
             resp = t.result()
         except Exception as ex:
@@ -384,18 +572,15 @@ def flet_main(page: ft.Page):
             title = "Request failed"
             if resp.startswith("ERROR:429_INSUFFICIENT_QUOTA"):
                 title = "Insufficient quota (429)"
-            # Show SnackBar
-            page.snack_bar = ft.SnackBar(
-                content=ft.Text(title, color=ft.Colors.WHITE),
-                bgcolor=ft.Colors.RED_600,
-                show_close_icon=True,
-            )
-            page.snack_bar.open = True
-            page.update()
+            show_error(title)
         else:
-            append_message(resp, "resp")
+            if slot is None:
+                append_message(resp, "resp")
+            else:
+                state["shown_item"] = None
+                output_lv.controls.insert(slot, make_message(resp, "resp"))
             state["last_resp_text"] = resp
-            save_hist_pair(state["last_req_text"], resp)
+            save_hist_pair(req, resp)
         page.update()
 
     def do_send(_=None):
@@ -403,22 +588,65 @@ def flet_main(page: ft.Page):
         if not txt:
             return
         append_message(txt, "req")
-        state["last_req_text"] = txt
         state["last_resp_text"] = ""
         input_tf.value = ""
-        input_tf.update()
         send_btn.disabled = True
         typing_text.visible = True
         page.update()
 
         preset = attached_preset["text"]
+        live = {"row": None, "flush": 0.0}
+        state["streams"].append(live)
         # Запускаем задачу и подписываемся на завершение через add_done_callback
-        fut = page.run_task(process_send, txt, preset)
-        fut.add_done_callback(on_task_done)
+        fut = page.run_task(process_send, txt, preset, live)
+        fut.add_done_callback(lambda t: on_task_done(txt, live, t))
 
     # Bind send button click handler once
     send_btn.on_click = do_send
 
+    def on_batch_done(prompts: list[str], batch: dict, t: asyncio.Task):
+        state["streams"] = [x for x in state["streams"] if x is not batch]
+        typing_text.visible = bool(state["streams"])
+        send_btn.disabled = False
+        batch_btn.disabled = False
+        try:
+            results = t.result()
+        except Exception as ex:
+            results = [f"ERROR: {ex}"] * len(prompts)
+        failed = []
+        for req, resp in zip(prompts, results):
+            if resp.startswith("ERROR:"):
+                failed.append(req)
+                continue
+            append_message(req, "req")
+            append_message(resp, "resp")
+            save_hist_pair(req, resp)
+            state["last_resp_text"] = resp
+        if failed:
+            # hand the failed lines back so they can be retried; keep anything typed meanwhile
+            input_tf.value = "\n".join([*failed, input_tf.value] if input_tf.value else failed)
+            toggle_send_button()
+            show_error(f"{len(failed)} of {len(prompts)} requests failed")
+        page.update()
+
+    def do_send_batch(_=None):
+        prompts = [line.strip() for line in input_tf.value.splitlines() if line.strip()]
+        if not prompts:
+            return
+        input_tf.value = ""
+        send_btn.disabled = True
+        batch_btn.disabled = True
+        typing_text.visible = True
+        page.update()
+
+        # counted in state["streams"] so a single send finishing first keeps "typing…" up
+        batch = {"row": None, "flush": 0.0}
+        state["streams"].append(batch)
+        fut = page.run_task(send_many, prompts, attached_preset["text"])
+        fut.add_done_callback(lambda t: on_batch_done(prompts, batch, t))
+
+    batch_btn.on_click = do_send_batch
+
     # Copy last response button
     def copy_last(_=None):
         if state["last_resp_text"]:
@@ -426,20 +654,44 @@ def flet_main(page: ft.Page):
     copy_last_btn.on_click = copy_last
 
     def clear_history(_):
+        if state["save_fut"]:
+            state["save_fut"].cancel()
         page.client_storage.remove(HIST_KEY)
+        state["hist"] = []
+        state["shown_item"] = None
         output_lv.controls.clear()
         render_history_list()
         page.update()
 
     clear_btn.on_click = clear_history
 
-    sidebar = ft.Container(content=ft.Column([ft.Text("Presets", size=12, color=pal.muted), presets_dd, ft.Row([load_btn, detach_btn], spacing=8), ft.Divider(color=pal.border), ft.Text("Pinned preset", size=12, color=pal.muted), pinned, ft.Divider(color=pal.border), ft.Text("History", size=12, color=pal.muted), ft.Container(content=history_col, expand=True)], spacing=8, expand=True), width=300, bgcolor=pal.card, border=ft.border.all(1, pal.border), border_radius=12, padding=12)
+    def flush_history_now():
+        # A debounced write may still be pending; persist it before the window closes.
+        # Only called from the (sync, handler-thread) window event, where the blocking write is safe
+        fut = state["save_fut"]
+        if fut and not fut.done():
+            fut.cancel()
+            save_history(page, state["hist"])
+
+    def on_window_event(e: ft.WindowEvent):
+        if e.type == ft.WindowEventType.CLOSE:
+            flush_history_now()
+            page.window.destroy()
+
+    # Desktop: intercept the close so client_storage is still reachable while flushing
+    page.window.prevent_close = True
+    page.window.on_event = on_window_event
+
+    section_labels = [ft.Text(label, size=12, color=pal.muted) for label in ("Presets", "Pinned preset", "History")]
+    dividers = [ft.Divider(color=pal.border) for _ in range(2)]
+    sidebar = ft.Container(content=ft.Column([section_labels[0], presets_dd, ft.Row([load_btn, detach_btn], spacing=8), dividers[0], section_labels[1], pinned, dividers[1], section_labels[2], ft.Container(content=history_col, expand=True)], spacing=8, expand=True), width=300, bgcolor=pal.card, border=ft.border.all(1, pal.border), border_radius=12, padding=12)
 
     top_bar = ft.Container(content=ft.Row([ft.Row([brand_dot, ft.Text("BeepConf Chat", weight=ft.FontWeight.BOLD)], spacing=10, alignment=ft.MainAxisAlignment.START, vertical_alignment=ft.CrossAxisAlignment.CENTER, expand=True), typing_text, theme_btn, clear_btn], alignment=ft.MainAxisAlignment.SPACE_BETWEEN, vertical_alignment=ft.CrossAxisAlignment.CENTER), bgcolor=pal.card, border=ft.border.all(1, pal.border), border_radius=12, padding=ft.padding.symmetric(10, 12))
 
-    input_row = ft.Row([ft.Container(input_tf, expand=True), ft.Column([send_btn, copy_last_btn], spacing=10, alignment=ft.MainAxisAlignment.END)], spacing=10, vertical_alignment=ft.CrossAxisAlignment.END)
+    input_row = ft.Row([ft.Container(input_tf, expand=True), ft.Column([send_btn, batch_btn, copy_last_btn], spacing=10, alignment=ft.MainAxisAlignment.END)], spacing=10, vertical_alignment=ft.CrossAxisAlignment.END)
 
-    main_col = ft.Column([top_bar, ft.Container(output_lv, expand=True, bgcolor=pal.card, border_radius=12), input_row], spacing=10, expand=True)
+    output_box = ft.Container(output_lv, expand=True, bgcolor=pal.card, border_radius=12)
+    main_col = ft.Column([top_bar, output_box, input_row], spacing=10, expand=True)
 
     root = ft.Row([sidebar, main_col], spacing=10, expand=True)
 